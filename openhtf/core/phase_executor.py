@@ -249,7 +249,8 @@ class PhaseExecutor(object):
       phase: phase_descriptor.PhaseDescriptor,
       run_with_profiling: bool = False,
       subtest_rec: Optional[test_record.SubtestRecord] = None
-  ) -> Tuple[PhaseExecutionOutcome, Optional[pstats.Stats]]:
+  ) -> Tuple[PhaseExecutionOutcome, Optional[pstats.Stats],
+             Optional[test_record.PhaseRecord]]:
     """Executes a phase or skips it, yielding PhaseExecutionOutcome instances.
 
     Args:
@@ -259,20 +260,24 @@ class PhaseExecutor(object):
       subtest_rec: Optional subtest record.
 
     Returns:
-      A two-tuple; the first item is the final PhaseExecutionOutcome that wraps
-      the phase return value (or exception) of the final phase run. All
+      A three-tuple; the first item is the final PhaseExecutionOutcome that
+      wraps the phase return value (or exception) of the final phase run. All
       intermediary results, if any, are REPEAT and handled internally. Returning
       REPEAT here means the phase hit its limit for repetitions.
       The second tuple item is the profiler Stats object if profiling was
       requested and successfully ran for this phase execution.
+      The third tuple item is the PhaseRecord of the final phase run, or None
+      if no record was created because the phase was skipped via run_if or
+      execution was cancelled.
     """
     repeat_count = 1
     repeat_limit = (phase.options.repeat_limit or
                     DEFAULT_RETRIES)
     while not self._stopping.is_set():
       is_last_repeat = repeat_count >= repeat_limit
-      phase_execution_outcome, profile_stats = self._execute_phase_once(
-          phase, is_last_repeat, run_with_profiling, subtest_rec)
+      (phase_execution_outcome, profile_stats,
+       phase_record) = self._execute_phase_once(phase, is_last_repeat,
+                                                run_with_profiling, subtest_rec)
 
       # Give 3 default retries for timeout phase.
       # Force repeat up to the repeat limit if force_repeat is set.
@@ -283,9 +288,9 @@ class PhaseExecutor(object):
         repeat_count += 1
         continue
 
-      return phase_execution_outcome, profile_stats
+      return phase_execution_outcome, profile_stats, phase_record
     # We've been cancelled, so just 'timeout' the phase.
-    return PhaseExecutionOutcome(None), None
+    return PhaseExecutionOutcome(None), None, None
 
   def _execute_phase_once(
       self,
@@ -293,13 +298,15 @@ class PhaseExecutor(object):
       is_last_repeat: bool,
       run_with_profiling: bool,
       subtest_rec: Optional[test_record.SubtestRecord],
-  ) -> Tuple[PhaseExecutionOutcome, Optional[pstats.Stats]]:
+  ) -> Tuple[PhaseExecutionOutcome, Optional[pstats.Stats],
+             Optional[test_record.PhaseRecord]]:
     """Executes the given phase, returning a PhaseExecutionOutcome."""
     # Check this before we create a PhaseState and PhaseRecord.
     if phase_desc.options.run_if and not phase_desc.options.run_if():
       _LOG.debug('Phase %s skipped due to run_if returning falsey.',
                  phase_desc.name)
-      return PhaseExecutionOutcome(phase_descriptor.PhaseResult.SKIP), None
+      return (PhaseExecutionOutcome(phase_descriptor.PhaseResult.SKIP), None,
+              None)
 
     override_result = None
     with self.test_state.running_phase_context(phase_desc) as phase_state:
@@ -320,7 +327,7 @@ class PhaseExecutor(object):
           # Killed result.
           result = PhaseExecutionOutcome(threads.ThreadTerminationError())
           phase_state.result = result
-          return result, None
+          return result, None, phase_state.phase_record
         phase_thread = PhaseExecutorThread(phase_desc, self.test_state,
                                            run_with_profiling, subtest_rec)
         phase_thread.start()
@@ -340,7 +347,8 @@ class PhaseExecutor(object):
     _LOG.debug('Phase %s finished with result %s', phase_desc.name,
                result.phase_result)
     return (result,
-            phase_thread.get_profile_stats() if run_with_profiling else None)
+            phase_thread.get_profile_stats() if run_with_profiling else None,
+            phase_state.phase_record)
 
   def skip_phase(self, phase_desc: phase_descriptor.PhaseDescriptor,
                  subtest_rec: Optional[test_record.SubtestRecord]) -> None:
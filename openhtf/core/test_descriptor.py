@@ -284,7 +284,8 @@ class Test(object):
         that returns a DUT ID. If neither is provided, defaults to not setting
         the DUT ID.
       profile_filename: Name of file to put profiling stats into. This also
-        enables profiling data collection.
+        enables profiling data collection.  Set the profile_phase_sample_rate
+        config to profile only a sample of the phases.
 
     Returns:
       Boolean indicating whether the test failed (False) or passed (True).
@@ -18,14 +18,12 @@ import enum
 import logging
 import pstats
 import sys
-import tempfile
 import threading
-import traceback
-from typing import Iterator, List, Optional, Text, Type, TYPE_CHECKING
+from typing import (Dict, Iterator, List, Optional, Text, Tuple, Type,
+                    TYPE_CHECKING)
 
 from openhtf import util
 from openhtf.core import base_plugs
-from openhtf.core import diagnoses_lib
 from openhtf.core import phase_branches
 from openhtf.core import phase_collections
 from openhtf.core import phase_descriptor
@@ -56,6 +54,14 @@ CONF.declare(
     description='Stop current test execution and return Outcome FAIL'
     'on first phase with failed measurement.')
 
+CONF.declare(
+    'profile_phase_sample_rate',
+    default_value=1,
+    description='When profiling is enabled, profile only one in every N '
+    'phase executions. Deterministic profiling of every phase can slow '
+    'phase execution down several times over, so raise this for long '
+    'running tests.')
+
 
 class TestExecutionError(Exception):
   """Raised when there's an internal error during test execution."""
@@ -74,17 +80,36 @@ def _more_critical(e1: _ExecutorReturn, e2: _ExecutorReturn) -> _ExecutorReturn:
   return _ExecutorReturn(max(e1.value, e2.value))
 
 
+# Method names of the TestExecutor handler for each phase node type.  Order
+# matters: subclasses must come before their base classes.
+_NODE_HANDLERS = (
+    (phase_collections.Subtest, '_execute_subtest'),
+    (phase_branches.BranchSequence, '_execute_phase_branch'),
+    (phase_collections.PhaseSequence, '_execute_sequence'),
+    (phase_group.PhaseGroup, '_execute_phase_group'),
+    (phase_descriptor.PhaseDescriptor, '_execute_phase'),
+    (phase_branches.Checkpoint, '_execute_checkpoint'),
+)  # type: Tuple[Tuple[Type[phase_nodes.PhaseNode], Text], ...]
+
+# Maps exact node types to their handler method name, or None if unhandled.
+_NodeHandlerNames = Dict[Type[phase_nodes.PhaseNode], Optional[Text]]
+
+
+def _node_handler_name(
+    node_type: Type[phase_nodes.PhaseNode]) -> Optional[Text]:
+  for handled_type, handler_name in _NODE_HANDLERS:
+    if issubclass(node_type, handled_type):
+      return handler_name
+  return None
+
+
 def combine_profile_stats(profile_stats_iter: List[pstats.Stats],
                           output_filename: Text) -> None:
   """Given an iterable of pstats.Stats, combine them into a single Stats."""
-  profile_stats_filenames = []
-  for profile_stats in profile_stats_iter:
-    with tempfile.NamedTemporaryFile(delete=False) as f:
-      profile_stats_filename = f.name
-    profile_stats.dump_stats(profile_stats_filename)
-    profile_stats_filenames.append(profile_stats_filename)
-  if profile_stats_filenames:
-    pstats.Stats(*profile_stats_filenames).dump_stats(output_filename)
+  profile_stats_list = list(profile_stats_iter)
+  if profile_stats_list:
+    # Merge in memory into a fresh Stats so the inputs are left untouched.
+    pstats.Stats().add(*profile_stats_list).dump_stats(output_filename)
 
 
 # pylint: disable=too-many-instance-attributes
@@ -104,17 +129,42 @@ class TestExecutor(threads.KillableThread):
     self._test_descriptor = test_descriptor
     self._test_start = test_start
     self._test_options = test_options
-    self._lock = threading.Lock()
+    # Fixed for the duration of the test, so resolve the config only once.
+    self._stop_on_first_failure = bool(test_options.stop_on_first_failure or
+                                       CONF.stop_on_first_failure)
+    self._cancel_timeout_s = CONF.cancel_timeout_s
     self._phase_exec = None  # type: Optional[phase_executor.PhaseExecutor]
+    # The test's state logger, cached once the TestState is created.
+    self._state_logger = None  # type: Optional[logging.Logger]
     self.uid = execution_uid
     self._last_outcome = None  # type: Optional[phase_executor.PhaseExecutionOutcome]
     self._abort = threading.Event()
     self._full_abort = threading.Event()
+    # Plain mirrors of the abort events, checked before every node in the
+    # sequence loops; attribute reads are cheaper than Event.is_set() calls.
+    self._aborted = False
+    self._full_aborted = False
     # This is a reentrant lock so that the teardown logic that prevents aborts
     # affects nested sequences.
     self._teardown_phases_lock = threading.RLock()
     # Populated if profiling is enabled.
     self._phase_profile_stats = []  # type: List[pstats.Stats]
+    self._append_profile_stats = self._phase_profile_stats.append
+    # Only consulted when profiling; config values may arrive as strings.
+    self._profile_sample_rate = 1
+    if run_with_profiling:
+      self._profile_sample_rate = int(CONF.profile_phase_sample_rate)
+      if self._profile_sample_rate < 1:
+        raise ValueError(
+            'profile_phase_sample_rate must be at least 1, got {}'.format(
+                self._profile_sample_rate))
+    # Handler method name per exact node type, filled in as types are seen.
+    self._node_handler_names = {}  # type: _NodeHandlerNames
+    # Counts phase executions eligible for profiling, for sampling.
+    self._phase_counter = 0
+    # Whether the test's logger emits DEBUG records.  Refreshed once the
+    # TestState exists so that per-phase debug logging can be skipped cheaply.
+    self._debug_enabled = True
 
   @property
   def logger(self) -> logging.Logger:
@@ -140,11 +190,13 @@ class TestExecutor(threads.KillableThread):
     """Abort this test."""
     if self._abort.is_set():
       _LOG.error('Abort already set; forcibly stopping the process.')
+      self._full_aborted = True
       self._full_abort.set()
       self._stop_phase_executor(force=True)
       return
     _LOG.error('Abort test executor.')
     # Deterministically mark the test as aborted.
+    self._aborted = True
     self._abort.set()
     self._stop_phase_executor()
     # No need to kill this thread because the abort state has been set, it will
@@ -189,11 +241,11 @@ class TestExecutor(threads.KillableThread):
       # Top level steps required to run a single iteration of the Test.
       self.test_state = test_state.TestState(self._test_descriptor, self.uid,
                                              self._test_options)
-      phase_exec = phase_executor.PhaseExecutor(self.test_state)
-
-      # Any access to self._exit_stacks must be done while holding this lock.
-      with self._lock:
-        self._phase_exec = phase_exec
+      self._state_logger = self.test_state.state_logger
+      self._debug_enabled = self._state_logger.isEnabledFor(logging.DEBUG)
+      # Published with a single assignment; _stop_phase_executor reads it
+      # from other threads without locking.
+      self._phase_exec = phase_executor.PhaseExecutor(self.test_state)
 
       if self._test_start is not None and self._execute_test_start():
         # Exit early if test_start returned a terminal outcome of any kind.
@@ -211,8 +263,7 @@ class TestExecutor(threads.KillableThread):
       self._execute_node(self._test_descriptor.phase_sequence, None, False)
       self._execute_test_diagnosers()
     except:  # pylint: disable=bare-except
-      stacktrace = traceback.format_exc()
-      _LOG.error('Error in TestExecutor: \n%s', stacktrace)
+      _LOG.exception('Error in TestExecutor:')
       raise
     finally:
       self._execute_test_teardown()
@@ -256,11 +307,11 @@ class TestExecutor(threads.KillableThread):
         plug_types=[phase_plug.cls for phase_plug in self._test_start.plugs]):
       return True
 
-    outcome, profile_stats = self._phase_exec.execute_phase(
-        self._test_start, self._run_with_profiling)
+    outcome, profile_stats, _ = self._phase_exec.execute_phase(
+        self._test_start, self._should_profile_phase())
 
     if profile_stats is not None:
-      self._phase_profile_stats.append(profile_stats)
+      self._append_profile_stats(profile_stats)
 
     if outcome.is_terminal:
       self._last_outcome = outcome
@@ -270,17 +321,26 @@ class TestExecutor(threads.KillableThread):
       _LOG.warning('Start trigger did not set a DUT ID.')
     return False
 
+  def _should_profile_phase(self) -> bool:
+    """Returns whether the next phase execution should be profiled."""
+    if not self._run_with_profiling:
+      return False
+    count = self._phase_counter
+    self._phase_counter += 1
+    return count % self._profile_sample_rate == 0
+
   def _stop_phase_executor(self, force: bool = False) -> None:
-    with self._lock:
-      phase_exec = self._phase_exec
-      if not phase_exec:
-        # The test executor has not started yet, so no stopping is required.
-        return
+    # Attribute reads and writes are atomic, so no lock is needed to see the
+    # executor published by _thread_proc.
+    phase_exec = self._phase_exec
+    if not phase_exec:
+      # The test executor has not started yet, so no stopping is required.
+      return
     if not force and not self._teardown_phases_lock.acquire(False):
       # If locked, teardown phases are running, so do not cancel those.
       return
     try:
-      phase_exec.stop(timeout_s=CONF.cancel_timeout_s)
+      phase_exec.stop(timeout_s=self._cancel_timeout_s)
       # Resetting so phase_exec can run teardown phases.
       phase_exec.reset_stop()
     finally:
@@ -293,7 +353,7 @@ class TestExecutor(threads.KillableThread):
 
     # Now finalize the test state.
     if self._abort.is_set():
-      self.logger.debug('Finishing test with outcome ABORTED.')
+      self._state_logger.debug('Finishing test with outcome ABORTED.')
       self.test_state.abort()
     elif self._last_outcome and self._last_outcome.is_terminal:
       self.test_state.finalize_from_phase_outcome(self._last_outcome)
@@ -303,32 +363,33 @@ class TestExecutor(threads.KillableThread):
   def _execute_phase(self, phase: phase_descriptor.PhaseDescriptor,
                      subtest_rec: Optional[test_record.SubtestRecord],
                      in_teardown: bool) -> _ExecutorReturn:
-    if subtest_rec:
-      self.logger.debug('Executing phase %s under subtest %s', phase.name,
-                        subtest_rec.name)
-    else:
-      self.logger.debug('Executing phase %s', phase.name)
+    if self._debug_enabled:
+      if subtest_rec:
+        self._state_logger.debug('Executing phase %s under subtest %s',
+                                 phase.name, subtest_rec.name)
+      else:
+        self._state_logger.debug('Executing phase %s', phase.name)
 
+    phase_exec = self._phase_exec
     if not in_teardown and subtest_rec and subtest_rec.is_fail:
-      self._phase_exec.skip_phase(phase, subtest_rec)
+      phase_exec.skip_phase(phase, subtest_rec)
       return _ExecutorReturn.CONTINUE
 
-    outcome, profile_stats = self._phase_exec.execute_phase(
+    outcome, profile_stats, phase_rec = phase_exec.execute_phase(
         phase,
-        run_with_profiling=self._run_with_profiling,
+        run_with_profiling=self._should_profile_phase(),
         subtest_rec=subtest_rec)
     if profile_stats is not None:
-      self._phase_profile_stats.append(profile_stats)
-
-    if (self.test_state.test_options.stop_on_first_failure or
-        CONF.stop_on_first_failure):
-      # Stop Test on first measurement failure
-      current_phase_result = self.test_state.test_record.phases[
-          len(self.test_state.test_record.phases) - 1]
-      if current_phase_result.outcome == test_record.PhaseOutcome.FAIL:
-        outcome = phase_executor.PhaseExecutionOutcome(
-            phase_descriptor.PhaseResult.STOP)
-        self.logger.error('Stopping test because stop_on_first_failure is True')
+      self._append_profile_stats(profile_stats)
+
+    # Stop Test on first measurement failure.  There is no record when the
+    # phase was skipped via run_if.
+    if (self._stop_on_first_failure and phase_rec is not None and
+        phase_rec.outcome == test_record.PhaseOutcome.FAIL):
+      outcome = phase_executor.PhaseExecutionOutcome(
+          phase_descriptor.PhaseResult.STOP)
+      self._state_logger.error(
+          'Stopping test because stop_on_first_failure is True')
 
     if outcome.is_terminal:
       if not self._last_outcome:
@@ -365,11 +426,13 @@ class TestExecutor(threads.KillableThread):
     return _ExecutorReturn.CONTINUE
 
   def _log_sequence(self, phase_sequence, override_message):
+    if not self._debug_enabled:
+      return
     message = phase_sequence.name
     if override_message:
       message = override_message
     if message:
-      self.logger.debug('Executing phase nodes for %s', message)
+      self._state_logger.debug('Executing phase nodes for %s', message)
 
   def _execute_sequence(
       self,
@@ -407,10 +470,11 @@ class TestExecutor(threads.KillableThread):
     Returns:
       _ExecutorReturn for how to proceed.
     """
+    execute_node = self._execute_node
     for node in phase_sequence.nodes:
-      if self._abort.is_set():
+      if self._aborted:
         return _ExecutorReturn.TERMINAL
-      exe_ret = self._execute_node(node, subtest_rec, False)
+      exe_ret = execute_node(node, subtest_rec, False)
       if exe_ret != _ExecutorReturn.CONTINUE:
         return exe_ret
     return _ExecutorReturn.CONTINUE
@@ -427,14 +491,17 @@ class TestExecutor(threads.KillableThread):
     Returns:
       _ExecutorReturn for how to proceed.
     """
-    ret = _ExecutorReturn.CONTINUE
+    terminal = False
+    execute_node = self._execute_node
     with self._teardown_phases_lock:
       for node in phase_sequence.nodes:
-        if self._full_abort.is_set():
+        if self._full_aborted:
           return _ExecutorReturn.TERMINAL
-        ret = _more_critical(ret, self._execute_node(node, subtest_rec, True))
+        # Keep running the remaining nodes, but remember any terminal result.
+        terminal |= (
+            execute_node(node, subtest_rec, True) is _ExecutorReturn.TERMINAL)
 
-    return ret
+    return _ExecutorReturn.TERMINAL if terminal else _ExecutorReturn.CONTINUE
 
   @contextlib.contextmanager
   def _subtest_context(
@@ -451,7 +518,7 @@ class TestExecutor(threads.KillableThread):
     Yields:
       The subtest record for updating the outcome.
     """
-    self.logger.debug('%s: Starting subtest.', subtest.name)
+    self._state_logger.debug('%s: Starting subtest.', subtest.name)
     subtest_rec = test_record.SubtestRecord(
         name=subtest.name,
         start_time_millis=util.time_millis(),
@@ -472,12 +539,12 @@ class TestExecutor(threads.KillableThread):
 
       if ret == _ExecutorReturn.TERMINAL:
         subtest_rec.outcome = test_record.SubtestOutcome.STOP
-        self.logger.debug('%s: Subtest stopping the test.', subtest.name)
+        self._state_logger.debug('%s: Subtest stopping the test.', subtest.name)
       else:
         if subtest_rec.outcome is test_record.SubtestOutcome.FAIL:
-          self.logger.debug('%s: Subtest failed;', subtest.name)
+          self._state_logger.debug('%s: Subtest failed;', subtest.name)
         else:
-          self.logger.debug('%s: Subtest passed.', subtest.name)
+          self._state_logger.debug('%s: Subtest passed.', subtest.name)
       return ret
 
   def _execute_phase_branch(self, branch: phase_branches.BranchSequence,
@@ -487,19 +554,19 @@ class TestExecutor(threads.KillableThread):
     if branch.name:
       branch_message = '{}:{}'.format(branch.name, branch_message)
     if not in_teardown and subtest_rec and subtest_rec.is_fail:
-      self.logger.debug('%s: Branch not being run due to failed subtest.',
-                        branch_message)
+      self._state_logger.debug(
+          '%s: Branch not being run due to failed subtest.', branch_message)
       return _ExecutorReturn.CONTINUE
 
     evaluated_millis = util.time_millis()
     if branch.should_run(self.test_state.diagnoses_manager.store):
-      self.logger.debug('%s: Branch condition met; running phases.',
-                        branch_message)
+      self._state_logger.debug('%s: Branch condition met; running phases.',
+                               branch_message)
       branch_taken = True
       ret = self._execute_sequence(branch, subtest_rec, in_teardown)
     else:
-      self.logger.debug('%s: Branch condition NOT met; not running sequence.',
-                        branch_message)
+      self._state_logger.debug(
+          '%s: Branch condition NOT met; not running sequence.', branch_message)
       branch_taken = False
       ret = _ExecutorReturn.CONTINUE
 
@@ -517,7 +584,9 @@ class TestExecutor(threads.KillableThread):
     phases all run without error that the teardown phases will also run, no
     matter the errors during the main phases.
 
-    This function is recursive.  Do not construct phase groups that contain
+    This function is recursive through _execute_sequence, since nested nodes
+    need their own subtest context and teardown locking; each nesting level
+    costs a few stack frames.  Do not construct phase groups that contain
     themselves.
 
     Args:
@@ -526,11 +595,13 @@ class TestExecutor(threads.KillableThread):
       in_teardown: Indicates if currently processing a teardown sequence.
 
     Returns:
-      True if the phases are terminal; otherwise returns False.
+      _ExecutorReturn.TERMINAL if the setup phases or the more critical of the
+      main and teardown phases are terminal; otherwise CONTINUE.
     """
     message_prefix = ''
     if group.name:
-      self.logger.debug('Entering PhaseGroup %s', group.name)
+      if self._debug_enabled:
+        self._state_logger.debug('Entering PhaseGroup %s', group.name)
       message_prefix = group.name + ':'
     # If in a subtest and it is already failing, the group will not be entered,
     # so the teardown phases will need to be skipped.
@@ -570,37 +641,36 @@ class TestExecutor(threads.KillableThread):
   def _execute_node(self, node: phase_nodes.PhaseNode,
                     subtest_rec: Optional[test_record.SubtestRecord],
                     in_teardown: bool) -> _ExecutorReturn:
-    if isinstance(node, phase_collections.Subtest):
-      return self._execute_subtest(node, subtest_rec, in_teardown)
-    if isinstance(node, phase_branches.BranchSequence):
-      return self._execute_phase_branch(node, subtest_rec, in_teardown)
-    if isinstance(node, phase_collections.PhaseSequence):
-      return self._execute_sequence(node, subtest_rec, in_teardown)
-    if isinstance(node, phase_group.PhaseGroup):
-      return self._execute_phase_group(node, subtest_rec, in_teardown)
-    if isinstance(node, phase_descriptor.PhaseDescriptor):
-      return self._execute_phase(node, subtest_rec, in_teardown)
-    if isinstance(node, phase_branches.Checkpoint):
-      return self._execute_checkpoint(node, subtest_rec, in_teardown)
-    self.logger.error('Unhandled node type: %s', node)
-    return _ExecutorReturn.TERMINAL
-
-  def _execute_test_diagnoser(
-      self, diagnoser: diagnoses_lib.BaseTestDiagnoser) -> None:
+    node_type = type(node)
     try:
-      self.test_state.diagnoses_manager.execute_test_diagnoser(
-          diagnoser, self.test_state.test_record)
-    except Exception:  # pylint: disable=broad-except
-      if self._last_outcome and self._last_outcome.is_terminal:
-        self.logger.exception(
-            'Test Diagnoser %s raised an exception, but the test outcome is '
-            'already terminal; logging additional exception here.',
-            diagnoser.name)
-      else:
-        # Record the equivalent failure outcome and exit early.
-        self._last_outcome = phase_executor.PhaseExecutionOutcome(
-            phase_executor.ExceptionInfo(*sys.exc_info()))
+      handler_name = self._node_handler_names[node_type]
+    except KeyError:
+      handler_name = _node_handler_name(node_type)
+      self._node_handler_names[node_type] = handler_name
+    if handler_name is None:
+      self._state_logger.error('Unhandled node type: %s', node)
+      return _ExecutorReturn.TERMINAL
+    # Look the handler up by name so it can be patched on the instance.
+    return getattr(self, handler_name)(node, subtest_rec, in_teardown)
 
   def _execute_test_diagnosers(self) -> None:
-    for diagnoser in self._test_options.diagnosers:
-      self._execute_test_diagnoser(diagnoser)
+    diagnosers = self._test_options.diagnosers
+    if not diagnosers:
+      return
+    execute_test_diagnoser = (
+        self.test_state.diagnoses_manager.execute_test_diagnoser)
+    record = self.test_state.test_record
+    for diagnoser in diagnosers:
+      try:
+        execute_test_diagnoser(diagnoser, record)
+      except Exception:  # pylint: disable=broad-except
+        if self._last_outcome and self._last_outcome.is_terminal:
+          self._state_logger.exception(
+              'Test Diagnoser %s raised an exception, but the test outcome is '
+              'already terminal; logging additional exception here.',
+              diagnoser.name)
+        else:
+          # Record the equivalent failure outcome and continue with the
+          # remaining diagnosers.
+          self._last_outcome = phase_executor.PhaseExecutionOutcome(
+              phase_executor.ExceptionInfo(*sys.exc_info()))
@@ -70,6 +70,12 @@ CONF.declare(
     'The name of this test station',
     default_value=socket.gethostname())
 
+# Measurement outcomes that allow a phase to PASS, with and without
+# CONF.allow_unset_measurements.
+_PASSING_MEASUREMENT_OUTCOMES = frozenset((measurements.Outcome.PASS,))
+_PASSING_OR_UNSET_MEASUREMENT_OUTCOMES = frozenset(
+    (measurements.Outcome.PASS, measurements.Outcome.UNSET))
+
 
 class _Infer(enum.Enum):
   INFER = 0
@@ -344,7 +350,7 @@ class TestState(util.SubscribableStateMixin):
 
   @property
   def is_finalized(self) -> bool:
-    return self._status == self.Status.COMPLETED
+    return self._status is self.Status.COMPLETED
 
   def stop_running_phase(self) -> None:
     """Stops the currently running phase, allowing another phase to run."""
@@ -376,7 +382,7 @@ class TestState(util.SubscribableStateMixin):
     """Mark the test as actually running, can't be done once finalized."""
     if self._is_aborted():
       return
-    assert self._status == self.Status.WAITING_FOR_TEST_START
+    assert self._status is self.Status.WAITING_FOR_TEST_START
     self._status = self.Status.RUNNING
     self.notify_update()
 
@@ -395,13 +401,13 @@ class TestState(util.SubscribableStateMixin):
         description = str(result.exc_val)
       else:
         # openhtf.util.threads.ThreadTerminationError gets str'd directly.
-        code = str(type(phase_execution_outcome.phase_result).__name__)
-        description = str(phase_execution_outcome.phase_result)
+        code = type(result).__name__
+        description = str(result)
       self.test_record.add_outcome_details(code, description)
       if self._outcome_is_failure_exception(phase_execution_outcome):
         self.state_logger.error(
             'Outcome will be FAIL since exception was of type %s',
-            phase_execution_outcome.phase_result.exc_val)
+            result.exc_val)
         self._finalize(test_record.Outcome.FAIL)
       else:
         self.state_logger.critical(
@@ -412,7 +418,7 @@ class TestState(util.SubscribableStateMixin):
           self.state_logger.critical(
               'Traceback:%s%s%s%s',
               os.linesep,
-              phase_execution_outcome.phase_result.get_traceback_string(),
+              result.get_traceback_string(),
               os.linesep,
               description,
           )
@@ -738,9 +744,10 @@ class PhaseState(object):
     self.phase_record.measurements = self.measurements
 
   def _measurements_pass(self) -> bool:
-    allowed_outcomes = {measurements.Outcome.PASS}
     if CONF.allow_unset_measurements:
-      allowed_outcomes.add(measurements.Outcome.UNSET)
+      allowed_outcomes = _PASSING_OR_UNSET_MEASUREMENT_OUTCOMES
+    else:
+      allowed_outcomes = _PASSING_MEASUREMENT_OUTCOMES
 
     return all(meas.outcome in allowed_outcomes
                for meas in self.phase_record.measurements.values())
@@ -412,7 +412,7 @@ class PhaseOrTestIterator(Iterator):
         '_log_exception',
         side_effect=logging.exception):
       # Use _execute_phase_once because we want to expose all possible outcomes.
-      phase_result, profile_stats = executor._execute_phase_once(
+      phase_result, profile_stats, _ = executor._execute_phase_once(
           phase_desc,
           is_last_repeat=False,
           run_with_profiling=profile_filepath,
@@ -606,6 +606,58 @@ class TestExecutorTest(unittest.TestCase):
     self.assertTrue(ev.wait(1))
     executor.close()
 
+  @CONF.save_and_restore(profile_phase_sample_rate=2)
+  def test_profile_phase_sample_rate(self):
+    test = openhtf.Test(*_fake_phases('first', 'second', 'third'))
+    test.configure(default_dut_id='dut',)
+    executor = test_executor.TestExecutor(
+        test.descriptor,
+        'uid',
+        start_phase,
+        test._test_options,
+        run_with_profiling=True)
+
+    executor.start()
+    executor.wait()
+    record = executor.test_state.test_record
+    self.assertEqual(record.outcome, test_record.Outcome.PASS)
+    # Only the start phase and the 'second' phase are profiled.
+    self.assertEqual(2, len(executor.phase_profile_stats))
+    executor.close()
+
+  @CONF.save_and_restore(profile_phase_sample_rate=0)
+  def test_profile_phase_sample_rate_invalid(self):
+    test = openhtf.Test(blank_phase)
+    with self.assertRaises(ValueError):
+      test_executor.TestExecutor(
+          test.descriptor,
+          'uid',
+          start_phase,
+          test._test_options,
+          run_with_profiling=True)
+
+  @CONF.save_and_restore(profile_phase_sample_rate=0)
+  def test_profile_phase_sample_rate_ignored_without_profiling(self):
+    test = openhtf.Test(blank_phase)
+    # Does not raise, since the rate is unused without profiling.
+    test_executor.TestExecutor(
+        test.descriptor,
+        'uid',
+        start_phase,
+        test._test_options,
+        run_with_profiling=False)
+
+  @CONF.save_and_restore(profile_phase_sample_rate='2')
+  def test_profile_phase_sample_rate_from_string(self):
+    test = openhtf.Test(blank_phase)
+    executor = test_executor.TestExecutor(
+        test.descriptor,
+        'uid',
+        start_phase,
+        test._test_options,
+        run_with_profiling=True)
+    self.assertEqual(2, executor._profile_sample_rate)
+
 
 class TestExecutorExecutePhaseTest(unittest.TestCase):
 
@@ -631,13 +683,14 @@ class TestExecutorExecutePhaseTest(unittest.TestCase):
         test_descriptor.TestOptions(),
         run_with_profiling=False)
     self.test_exec.test_state = self.test_state
+    self.test_exec._state_logger = self.test_state.state_logger
     self.test_exec._phase_exec = self.phase_exec
 
   def testPhase_NotTerminal(self):
     phase = phase_descriptor.PhaseDescriptor(blank_phase)
     self.phase_exec.execute_phase.return_value = (
         phase_executor.PhaseExecutionOutcome(
-            phase_descriptor.PhaseResult.CONTINUE), None)
+            phase_descriptor.PhaseResult.CONTINUE), None, None)
     self.assertEqual(test_executor._ExecutorReturn.CONTINUE,
                      self.test_exec._execute_phase(phase, None, False))
 
@@ -652,7 +705,7 @@ class TestExecutorExecutePhaseTest(unittest.TestCase):
 
     self.phase_exec.execute_phase.return_value = (
         phase_executor.PhaseExecutionOutcome(
-            phase_descriptor.PhaseResult.CONTINUE), None)
+            phase_descriptor.PhaseResult.CONTINUE), None, None)
     self.assertEqual(test_executor._ExecutorReturn.CONTINUE,
                      self.test_exec._execute_phase(phase, None, False))
 
@@ -664,7 +717,7 @@ class TestExecutorExecutePhaseTest(unittest.TestCase):
     phase = phase_descriptor.PhaseDescriptor(blank_phase)
     outcome = phase_executor.PhaseExecutionOutcome(
         phase_descriptor.PhaseResult.STOP)
-    self.phase_exec.execute_phase.return_value = outcome, None
+    self.phase_exec.execute_phase.return_value = outcome, None, None
     self.assertEqual(test_executor._ExecutorReturn.TERMINAL,
                      self.test_exec._execute_phase(phase, None, False))
 
@@ -678,7 +731,7 @@ class TestExecutorExecutePhaseTest(unittest.TestCase):
     self.test_exec._last_outcome = set_outcome
     outcome = phase_executor.PhaseExecutionOutcome(
         phase_descriptor.PhaseResult.STOP)
-    self.phase_exec.execute_phase.return_value = outcome, None
+    self.phase_exec.execute_phase.return_value = outcome, None, None
     self.assertEqual(test_executor._ExecutorReturn.TERMINAL,
                      self.test_exec._execute_phase(phase, None, False))
 
@@ -686,6 +739,46 @@ class TestExecutorExecutePhaseTest(unittest.TestCase):
         phase, run_with_profiling=False, subtest_rec=None)
     self.assertIs(set_outcome, self.test_exec._last_outcome)
 
+  def testPhase_StopOnFirstFailure_UsesReturnedRecord(self):
+    self.test_exec._stop_on_first_failure = True
+    phase = phase_descriptor.PhaseDescriptor(blank_phase)
+    phase_rec = mock.MagicMock(
+        spec=test_record.PhaseRecord, outcome=test_record.PhaseOutcome.FAIL)
+    self.phase_exec.execute_phase.return_value = (
+        phase_executor.PhaseExecutionOutcome(
+            phase_descriptor.PhaseResult.CONTINUE), None, phase_rec)
+    self.assertEqual(test_executor._ExecutorReturn.TERMINAL,
+                     self.test_exec._execute_phase(phase, None, False))
+    self.assertEqual(phase_descriptor.PhaseResult.STOP,
+                     self.test_exec._last_outcome.phase_result)
+
+  def testPhase_StopOnFirstFailure_NoRecord(self):
+    self.test_exec._stop_on_first_failure = True
+    phase = phase_descriptor.PhaseDescriptor(blank_phase)
+    self.phase_exec.execute_phase.return_value = (
+        phase_executor.PhaseExecutionOutcome(
+            phase_descriptor.PhaseResult.SKIP), None, None)
+    self.assertEqual(test_executor._ExecutorReturn.CONTINUE,
+                     self.test_exec._execute_phase(phase, None, False))
+    self.assertIsNone(self.test_exec._last_outcome)
+
+  def testNode_DispatchesByType(self):
+    phase = phase_descriptor.PhaseDescriptor(blank_phase)
+    checkpoint = phase_branches.PhaseFailureCheckpoint.all_previous('cp')
+    with mock.patch.object(self.test_exec, '_execute_phase') as mock_phase, \
+        mock.patch.object(self.test_exec, '_execute_checkpoint') as mock_cp:
+      for _ in range(2):
+        self.test_exec._execute_node(phase, None, False)
+        self.test_exec._execute_node(checkpoint, None, True)
+    mock_phase.assert_has_calls([mock.call(phase, None, False)] * 2)
+    mock_cp.assert_has_calls([mock.call(checkpoint, None, True)] * 2)
+
+  def testNode_Unhandled(self):
+    self.assertEqual(test_executor._ExecutorReturn.TERMINAL,
+                     self.test_exec._execute_node(object(), None, False))
+    self.test_state.state_logger.error.assert_called_once_with(
+        'Unhandled node type: %s', mock.ANY)
+
 
 class TestExecutorExecuteSequencesTest(unittest.TestCase):
 
@@ -708,6 +801,7 @@ class TestExecutorExecuteSequencesTest(unittest.TestCase):
         test_descriptor.TestOptions(),
         run_with_profiling=False)
     self.test_exec.test_state = self.test_state
+    self.test_exec._state_logger = self.test_state.state_logger
     patcher = mock.patch.object(self.test_exec, '_execute_node')
     self.mock_execute_node = patcher.start()
 
@@ -863,6 +957,7 @@ class TestExecutorExecutePhaseGroupTest(unittest.TestCase):
         test_descriptor.TestOptions(),
         run_with_profiling=False)
     self.test_exec.test_state = self.test_state
+    self.test_exec._state_logger = self.test_state.state_logger
     patcher = mock.patch.object(self.test_exec, '_execute_sequence')
     self.mock_execute_sequence = patcher.start()
 
@@ -1052,6 +1147,7 @@ class TestExecutorExecuteBranchTest(parameterized.TestCase):
         test_descriptor.TestOptions(),
         run_with_profiling=False)
     self.test_exec.test_state = self.test_state
+    self.test_exec._state_logger = self.test_state.state_logger
     patcher = mock.patch.object(self.test_exec, '_execute_sequence')
     self.mock_execute_sequence = patcher.start()
 
@@ -1142,34 +1238,34 @@ class PhaseExecutorTest(unittest.TestCase):
     self.phase_executor = phase_executor.PhaseExecutor(self.test_state)
 
   def test_execute_continue_phase(self):
-    result, _ = self.phase_executor.execute_phase(phase_two)
+    result, _, _ = self.phase_executor.execute_phase(phase_two)
     self.assertEqual(openhtf.PhaseResult.CONTINUE, result.phase_result)
 
   def test_execute_repeat_okay_phase(self):
-    result, _ = self.phase_executor.execute_phase(
+    result, _, _ = self.phase_executor.execute_phase(
         phase_repeat.with_plugs(test_plug=UnittestPlug))
     self.assertEqual(openhtf.PhaseResult.CONTINUE, result.phase_result)
 
   def test_execute_repeat_limited_phase(self):
-    result, _ = self.phase_executor.execute_phase(
+    result, _, _ = self.phase_executor.execute_phase(
         phase_repeat.with_plugs(test_plug=MoreRepeatsUnittestPlug))
     self.assertEqual(openhtf.PhaseResult.STOP, result.phase_result)
 
   def test_execute_run_if_false(self):
-    result, _ = self.phase_executor.execute_phase(phase_skip_from_run_if)
+    result, _, _ = self.phase_executor.execute_phase(phase_skip_from_run_if)
     self.assertEqual(openhtf.PhaseResult.SKIP, result.phase_result)
 
   def test_execute_phase_return_skip(self):
-    result, _ = self.phase_executor.execute_phase(phase_return_skip)
+    result, _, _ = self.phase_executor.execute_phase(phase_return_skip)
     self.assertEqual(openhtf.PhaseResult.SKIP, result.phase_result)
 
   def test_execute_phase_return_fail_and_continue(self):
-    result, _ = self.phase_executor.execute_phase(
+    result, _, _ = self.phase_executor.execute_phase(
         phase_return_fail_and_continue)
     self.assertEqual(openhtf.PhaseResult.FAIL_AND_CONTINUE, result.phase_result)
 
   def test_execute_phase_bad_phase_return(self):
-    result, _ = self.phase_executor.execute_phase(bad_return_phase)
+    result, _, _ = self.phase_executor.execute_phase(bad_return_phase)
     self.assertEqual(
         phase_executor.ExceptionInfo(phase_executor.InvalidPhaseResultError,
                                      mock.ANY, mock.ANY), result.phase_result)